@@ -33,9 +33,10 @@ CHP Sizing class
 This Python class contains methods and attributes specific for technology analysis within StorageVet.
 """
 import cvxpy as cvx
+import numpy as np
 from dervet.MicrogridDER.CombustionTurbine import CT
 import storagevet.Library as Lib
-from storagevet.ErrorHandling import *
+from storagevet.ErrorHandling import TellUser
 
 
 class CHP(CT):
@@ -63,36 +64,88 @@ class CHP(CT):
         # time series inputs
         self.site_steam_load = params.get('site_steam_load')    # BTU/hr
         self.site_hotwater_load = params.get('site_hotwater_load')    # BTU/hr
+        # the site loads as given, and their grown versions keyed by (years, frequency)
+        self.site_steam_load_input = self.site_steam_load
+        self.site_hotwater_load_input = self.site_hotwater_load
+        self.grown_site_loads = {}
 
     def grow_drop_data(self, years, frequency, load_growth):
-        if self.site_steam_load is not None:
-            self.site_steam_load = Lib.fill_extra_data(self.site_steam_load, years, 0, frequency)
-            # TODO use a non-zero growth rate of steam load? --AE
-            self.site_steam_load = Lib.drop_extra_data(self.site_steam_load, years)
-        if self.site_hotwater_load is not None:
-            self.site_hotwater_load = Lib.fill_extra_data(self.site_hotwater_load, years, 0, frequency)
-            # TODO use a non-zero growth rate of hotwater load? --AE
-            self.site_hotwater_load = Lib.drop_extra_data(self.site_hotwater_load, years)
+        """ Adds data by growing the given data OR drops any extra data that might have slipped in.
+        Update variable that hold timeseries data after adding growth data. These method should be called after
+        add_growth_data and before the optimization is run.
+
+        The site loads are always grown from the given input, and the result is reused if the
+        same years and frequency are asked for again.
+
+        Args:
+            years (List): list of years for which analysis will occur on
+            frequency (str): period frequency of the timeseries data
+            load_growth (float): percent/ decimal value of the growth rate of loads in this simulation
+
+        """
+        super().grow_drop_data(years, frequency, load_growth)
+        key = (tuple(years), frequency)
+        if key not in self.grown_site_loads:
+            # TODO use a non-zero growth rate of steam/hotwater load? --AE
+            self.grown_site_loads[key] = (self.grow_site_load(self.site_steam_load_input, years, frequency),
+                                          self.grow_site_load(self.site_hotwater_load_input, years, frequency))
+        self.site_steam_load, self.site_hotwater_load = self.grown_site_loads[key]
+
+    @staticmethod
+    def grow_site_load(site_load, years, frequency):
+        """ Fills SITE_LOAD out to cover YEARS (with no growth) and drops data outside of YEARS
+
+        Returns: the grown site load, or None if there is no site load
+
+        """
+        if site_load is None:
+            return None
+        site_load = Lib.fill_extra_data(site_load, years, 0, frequency)
+        return Lib.drop_extra_data(site_load, years)
 
     def initialize_variables(self, size):
         # rotating generation
         super().initialize_variables(size)
-        # plus heat (steam and hotwater)
+        # plus heat: one variable with a row for steam and a row for hotwater
+        self.thermal_variable = cvx.Variable(shape=(2, size), name=f'{self.name}-thermalP',
+                                             nonneg=True)
         self.variables_dict.update({
-            'steam': cvx.Variable(shape=size, name=f'{self.name}-steamP', nonneg=True),
-            'hotwater': cvx.Variable(shape=size, name=f'{self.name}-hotwaterP', nonneg=True),
+            'steam': self.thermal_variable[0, :],
+            'hotwater': self.thermal_variable[1, :],
         })
 
-    def constraints(self, mask):
-        constraint_list = super().constraints(mask)
-        elec = self.variables_dict['elec']
-        steam = self.variables_dict['steam']
-        hotwater = self.variables_dict['hotwater']
+    @staticmethod
+    def collect_constraints(chp_list, mask):
+        """ Builds the electric/heat coupling constraints of every CHP in CHP_LIST as a single
+        stacked block (one row per CHP), instead of a pair of constraints per CHP instance.
+        These constraints are only added by MicrogridPOI.optimization_problem: CHP.constraints
+        does not include them, so callers of der.constraints (like Reliability's sizing and
+        minimum SOE problems) do not couple a CHP's electric and heat generation.
+
+        Args:
+            chp_list (list): CHP instances that are active in the optimization window
+            mask (DataFrame): A boolean array that is true for indices corresponding to
+                time_series data included in the subs data set
+
+        Returns: A list of constraints
+
+        """
+        if not len(chp_list):
+            return []
+        opt_size = sum(mask)
+        elec = cvx.vstack([chp.variables_dict['elec'] for chp in chp_list])
+        steam = cvx.vstack([chp.variables_dict['steam'] for chp in chp_list])
+        hotwater = cvx.vstack([chp.variables_dict['hotwater'] for chp in chp_list])
+        total_heat = cvx.vstack([cvx.sum(chp.thermal_variable, axis=0) for chp in chp_list])
+        # each CHP's ratios, repeated across the optimization window
+        max_steam_ratio = np.outer([chp.max_steam_ratio for chp in chp_list], np.ones(opt_size))
+        electric_heat_ratio = np.outer([chp.electric_heat_ratio for chp in chp_list],
+                                       np.ones(opt_size))
 
         # to ensure that CHP never produces more steam than it can
-        constraint_list += [cvx.NonPos(steam - self.max_steam_ratio * hotwater)]
+        constraint_list = [steam <= cvx.multiply(max_steam_ratio, hotwater)]
 
-        constraint_list += [cvx.Zero((steam + hotwater) * self.electric_heat_ratio - elec)]
+        constraint_list += [cvx.multiply(electric_heat_ratio, total_heat) == elec]
 
         return constraint_list
 
@@ -111,12 +164,12 @@ class CHP(CT):
         tech_id = self.unique_tech_id()
         results = super().timeseries_report()
 
-        results[tech_id + ' Steam Generation (kW)'] = self.variables_df['steam']
-        results[tech_id + ' Hot Water Generation (kW)'] = self.variables_df['hotwater']
+        results[f'{tech_id} Steam Generation (kW)'] = self.variables_df['steam']
+        results[f'{tech_id} Hot Water Generation (kW)'] = self.variables_df['hotwater']
         if self.site_steam_load is not None:
-            results[tech_id + ' Site Steam Thermal Load (BTU/hr)'] = self.site_steam_load
+            results[f'{tech_id} Site Steam Thermal Load (BTU/hr)'] = self.site_steam_load
         if self.site_hotwater_load is not None:
-            results[tech_id + ' Site Hot Water Thermal Load (BTU/hr)'] = self.site_hotwater_load
+            results[f'{tech_id} Site Hot Water Thermal Load (BTU/hr)'] = self.site_hotwater_load
 
         return results
 
@@ -34,8 +34,9 @@ MicrogridPOI.py
 
 import pandas as pd
 from storagevet.POI import POI
+from dervet.MicrogridDER.CombinedHeatPower import CHP
 import cvxpy as cvx
-from storagevet.ErrorHandling import *
+from storagevet.ErrorHandling import TellUser, ParameterError
 import numpy as np
 
 
@@ -51,20 +52,26 @@ class MicrogridPOI(POI):
         if self.is_sizing_optimization:
             self.error_checks_on_sizing()
 
-        # add thermal site load time series
-        for der in self.active_ders:
-            try:
-                self.site_steam_load = der.site_steam_load
-            except AttributeError:
-                self.site_steam_load = None
-            try:
-                self.site_hotwater_load = der.site_hotwater_load
-            except AttributeError:
-                self.site_hotwater_load = None
-            try:
-                self.site_cooling_load = der.site_cooling_load
-            except AttributeError:
-                self.site_cooling_load = None
+        self.group_active_ders()
+        self.set_site_loads()
+
+    def set_site_loads(self):
+        """ Adds the thermal site load time series (from the first active DER that has each of
+        them). The DERs rebind their site loads when their data is grown, so this is called again
+        every time the active DERs are grabbed for an optimization window.
+
+        """
+        self.site_steam_load = self.find_site_load('site_steam_load')
+        self.site_hotwater_load = self.find_site_load('site_hotwater_load')
+        self.site_cooling_load = self.find_site_load('site_cooling_load')
+
+    def find_site_load(self, attribute):
+        """ Returns the first site load time series called ATTRIBUTE among the active DERs, or
+        None if no active DER has one
+
+        """
+        return next((getattr(der, attribute) for der in self.active_ders
+                     if getattr(der, attribute, None) is not None), None)
 
     def check_if_sizing_ders(self):
         """ This method will iterate through the initialized DER instances and return a logical OR
@@ -73,14 +80,8 @@ class MicrogridPOI(POI):
         Returns: True if ANY DER is getting sized
 
         """
-        for der_instance in self.der_list:
-            try:
-                solve_for_size = der_instance.being_sized()
-            except AttributeError:
-                solve_for_size = False
-            if solve_for_size:
-                return True
-        return False
+        return any(getattr(der_instance, 'being_sized', lambda: False)()
+                   for der_instance in self.der_list)
 
     def grab_active_ders(self, indx):
         """ drops DER that are not considered active in the optimization window's horizon
@@ -89,17 +90,31 @@ class MicrogridPOI(POI):
         year = indx.year[0]
         active_ders = [der_inst for der_inst in self.der_list if der_inst.operational(year)]
         self.active_ders = active_ders
+        self.group_active_ders()
+        self.set_site_loads()
+
+    def group_active_ders(self):
+        """ Sorts the active DERs into the groups that the POI's optimization methods treat
+        differently, so that they do not have to check the type of every DER each time they are
+        called
+
+        """
+        self.active_evs = [der_inst for der_inst in self.active_ders
+                           if der_inst.technology_type == 'Electric Vehicle']
+        self.active_chps = [der_inst for der_inst in self.active_ders if der_inst.tag == 'CHP']
+        self.active_heat_sources = [der_inst for der_inst in self.active_ders if der_inst.is_hot]
+        self.active_cold_sources = [der_inst for der_inst in self.active_ders if der_inst.is_cold]
 
     def error_checks_on_sizing(self):
         # perform error checks on DERs that are being sized
         # collect errors and raise if any were found
-        errors_found = [1 if der.sizing_error() else 0 for der in self.der_list]
-        if sum(errors_found):
+        # (every DER is checked, so that each one can report its errors to the user)
+        errors_found = [der.sizing_error() for der in self.der_list]
+        if any(errors_found):
             raise ParameterError(f'Sizing of DERs has an error. Please check error log.')
 
     def is_any_sizable_der_missing_power_max(self):
-        return bool(sum([1 if not der_inst.max_power_defined else 0
-                         for der_inst in self.der_list]))
+        return any(not der_inst.max_power_defined for der_inst in self.der_list)
 
     def set_size(self, value_streams, start_year):
         """ part of Deferral's sizing module: TODO USE THIS INSTEAD OF set_size IN MICROGRID SERVICE AGGREGATOR
@@ -116,9 +131,8 @@ class MicrogridPOI(POI):
         deferral = value_streams.get('Deferral')
         min_year = deferral.min_years
         last_year_to_defer = start_year.year + min_year - 1
-        p_e_req = deferral.deferral_df.loc[last_year_to_defer, :]
-        min_power = p_e_req.loc['Power Capacity Requirement (kW)']
-        min_energy = p_e_req.loc['Energy Capacity Requirement (kWh)']
+        min_power = deferral.deferral_df.at[last_year_to_defer, 'Power Capacity Requirement (kW)']
+        min_energy = deferral.deferral_df.at[last_year_to_defer, 'Energy Capacity Requirement (kWh)']
         ess_inst = self.der_list[0]
         if len(value_streams.keys()) > 1:
             ess_inst.size_constraints += [cvx.NonPos(min_energy - ess_inst.ene_max_rated)]
@@ -175,43 +189,72 @@ class MicrogridPOI(POI):
             agg_thermal_cooling_power = super().get_state_of_system(mask)
 
         # dervet-specific
-        for der_inst in self.active_ders:
-            # add to aggregate values for dervet-specific technology-types
-            if der_inst.technology_type == 'Electric Vehicle':
-                load_sum += der_inst.get_charge(mask)
-                # total_soe += der_instance.get_state_of_energy(mask)
-
-            # thermal power recovered: hot (steam/hotwater) and cold
-            if der_inst.is_hot:
-                if self.site_steam_load is None and self.site_hotwater_load is None:
-                    TellUser.warning('A heat source technology is active ' +
-                                     f'({der_inst.unique_tech_id()}), but you have set the ' +
-                                     f'scenario parameter incl_thermal_load to False. Any ' +
-                                     f'thermal load will be ignored.')
-                else:
-                    if self.site_steam_load is not None:
-                        TellUser.debug(f'adding heat (steam) recovered from this DER: ' +
-                                       f'{der_inst.unique_tech_id()}')
-                        agg_steam_heating_power += der_inst.get_steam_recovered(mask)
-                    if self.site_hotwater_load is not None:
-                        TellUser.debug(f'adding heat (hotwater) recovered from this DER: ' +
-                                       f'{der_inst.unique_tech_id()}')
-                        agg_hotwater_heating_power += der_inst.get_hotwater_recovered(mask)
-            if der_inst.is_cold:
-                if self.site_cooling_load is None:
-                    TellUser.warning(f'A cold source technology is active ' +
-                                     f'({der_inst.unique_tech_id()}), but you have set the ' +
-                                     f'scenario parameter incl_thermal_load to False. Any ' +
-                                     f'thermal load will be ignored.')
-                else:
-                    TellUser.debug(f'adding cold recovered from this DER: ' +
+        # collect each DER's contribution, then add them in as one n-ary sum per quantity
+        # add to aggregate values for dervet-specific technology-types
+        ev_charge = [der_inst.get_charge(mask) for der_inst in self.active_evs]
+        # total_soe += der_instance.get_state_of_energy(mask)
+
+        # thermal power recovered: hot (steam/hotwater) and cold
+        steam_recovered = []
+        hotwater_recovered = []
+        cold_recovered = []
+        for der_inst in self.active_heat_sources:
+            if self.site_steam_load is None and self.site_hotwater_load is None:
+                TellUser.warning('A heat source technology is active ' +
+                                 f'({der_inst.unique_tech_id()}), but you have set the ' +
+                                 f'scenario parameter incl_thermal_load to False. Any ' +
+                                 f'thermal load will be ignored.')
+            else:
+                if self.site_steam_load is not None:
+                    TellUser.debug(f'adding heat (steam) recovered from this DER: ' +
+                                   f'{der_inst.unique_tech_id()}')
+                    steam_recovered.append(der_inst.get_steam_recovered(mask))
+                if self.site_hotwater_load is not None:
+                    TellUser.debug(f'adding heat (hotwater) recovered from this DER: ' +
                                    f'{der_inst.unique_tech_id()}')
-                    agg_thermal_cooling_power += der_inst.get_cold_recovered(mask)
+                    hotwater_recovered.append(der_inst.get_hotwater_recovered(mask))
+        for der_inst in self.active_cold_sources:
+            if self.site_cooling_load is None:
+                TellUser.warning(f'A cold source technology is active ' +
+                                 f'({der_inst.unique_tech_id()}), but you have set the ' +
+                                 f'scenario parameter incl_thermal_load to False. Any ' +
+                                 f'thermal load will be ignored.')
+            else:
+                TellUser.debug(f'adding cold recovered from this DER: ' +
+                               f'{der_inst.unique_tech_id()}')
+                cold_recovered.append(der_inst.get_cold_recovered(mask))
+
+        if len(ev_charge):
+            load_sum = load_sum + self.sum_expressions(ev_charge)
+        if len(steam_recovered):
+            agg_steam_heating_power = agg_steam_heating_power + \
+                self.sum_expressions(steam_recovered)
+        if len(hotwater_recovered):
+            agg_hotwater_heating_power = agg_hotwater_heating_power + \
+                self.sum_expressions(hotwater_recovered)
+        if len(cold_recovered):
+            agg_thermal_cooling_power = agg_thermal_cooling_power + \
+                self.sum_expressions(cold_recovered)
 
         return load_sum, var_gen_sum, gen_sum, tot_net_ess, total_soe, agg_power_flows_in, \
             agg_power_flows_out, agg_steam_heating_power, agg_hotwater_heating_power, \
             agg_thermal_cooling_power
 
+    @staticmethod
+    def sum_expressions(expressions):
+        """ Adds together a list of same-shaped expressions with a single sum over their stack,
+        rather than a chain of binary additions (one per expression).
+
+        Args:
+            expressions (list): cvx.Expressions, each the length of the optimization window
+
+        Returns: the element-wise sum of EXPRESSIONS
+
+        """
+        if len(expressions) == 1:
+            return expressions[0]
+        return cvx.sum(cvx.vstack(expressions), axis=0)
+
     def optimization_problem(self, mask, power_in, power_out, steam_in, hotwater_in, cold_in,
                              annuity_scalar=1):
         """ Builds the master POI constraint list for the subset of time series data being
@@ -241,26 +284,32 @@ class MicrogridPOI(POI):
                                                                        steam_in, hotwater_in,
                                                                        cold_in, annuity_scalar)
 
+        # electric/heat coupling of all active CHPs, built as one block
+        constraint_list += CHP.collect_constraints(self.active_chps, mask)
+
         # thermal power balance constraints
         if self.site_steam_load is not None:
             if steam_in.variables():
                 TellUser.debug('adding steam thermal power balance constraint')
-                constraint_list += [cvx.NonPos(-steam_in + self.site_steam_load)]
+                site_steam_load = self.site_steam_load.loc[mask].values
+                constraint_list += [cvx.NonPos(-steam_in + site_steam_load)]
         if self.site_hotwater_load is not None:
             if hotwater_in.variables():
                 TellUser.debug('adding hot water thermal power balance constraint')
-                constraint_list += [cvx.NonPos(-hotwater_in + self.site_hotwater_load)]
+                site_hotwater_load = self.site_hotwater_load.loc[mask].values
+                constraint_list += [cvx.NonPos(-hotwater_in + site_hotwater_load)]
         if self.site_cooling_load is not None:
             if cold_in.variables():
                 TellUser.debug('adding thermal cooling power balance constraint')
-                constraint_list += [cvx.NonPos(-cold_in + self.site_cooling_load)]
+                site_cooling_load = self.site_cooling_load.loc[mask].values
+                constraint_list += [cvx.NonPos(-cold_in + site_cooling_load)]
 
         return obj_expression, constraint_list
 
     def sizing_summary(self):
-        rows = list(map(lambda der: der.sizing_summary(), self.der_list))
-        sizing_df = pd.DataFrame(rows)
-        sizing_df.set_index('DER')
+        records = [der.sizing_summary() for der in self.der_list]
+        # 'DER' is kept as a column: the size report is saved without its index
+        sizing_df = pd.DataFrame.from_records(records)
         return sizing_df
 
     def merge_reports(self, is_dispatch_opt, index):
@@ -272,52 +321,65 @@ class MicrogridPOI(POI):
             results pertaining to this instance
 
         """
-        results = pd.DataFrame(index=index)
-        monthly_data = pd.DataFrame()
-
-        # initialize all the data columns that will ALWAYS be present in our results
-        results.loc[:, 'Total Original Load (kW)'] = 0
-        results.loc[:, 'Total Load (kW)'] = 0
-        results.loc[:, 'Total Generation (kW)'] = 0
-        results.loc[:, 'Total Storage Power (kW)'] = 0
-        results.loc[:, 'Aggregated State of Energy (kWh)'] = 0
+        # each DER's reports are collected here and concatenated once after the loop
+        report_frames = []
+        monthly_frames = []
+
+        # accumulate the data columns that will ALWAYS be present in our results
+        # (these start as integer zeros, and only become floats once a DER adds to them, so
+        # that the columns no DER adds to are saved as 0, not 0.0)
+        total_original_load = np.zeros(len(index), dtype=int)
+        total_load = np.zeros(len(index), dtype=int)
+        total_generation = np.zeros(len(index), dtype=int)
+        total_storage_power = np.zeros(len(index), dtype=int)
+        aggregated_soe = np.zeros(len(index), dtype=int)
 
         for der in self.der_list:
             report_df = der.timeseries_report()
-            results = pd.concat([report_df, results], axis=1)
+            report_frames.append(report_df)
             if is_dispatch_opt:
+                tech_id = der.unique_tech_id()
                 if der.technology_type in ['Generator', 'Intermittent Resource']:
-                    results.loc[:, 'Total Generation (kW)'] += \
-                        results[f'{der.unique_tech_id()} Electric Generation (kW)']
+                    total_generation = total_generation + \
+                        report_df[f'{tech_id} Electric Generation (kW)'].to_numpy()
                 if der.technology_type == 'Energy Storage System':
-                    results.loc[:, 'Total Storage Power (kW)'] += \
-                        results[f'{der.unique_tech_id()} Power (kW)']
-                    results.loc[:, 'Aggregated State of Energy (kWh)'] += \
-                        results[f'{der.unique_tech_id()} State of Energy (kWh)']
+                    total_storage_power = total_storage_power + \
+                        report_df[f'{tech_id} Power (kW)'].to_numpy()
+                    aggregated_soe = aggregated_soe + \
+                        report_df[f'{tech_id} State of Energy (kWh)'].to_numpy()
                 if der.technology_type == 'Load':
-                    results.loc[:, 'Total Original Load (kW)'] += \
-                        results[f'{der.unique_tech_id()} Original Load (kW)']
+                    total_original_load = total_original_load + \
+                        report_df[f'{tech_id} Original Load (kW)'].to_numpy()
                     if der.tag == "ControllableLoad":
-                        results.loc[:, 'Total Load (kW)'] += \
-                            results[f'{der.unique_tech_id()} Load (kW)']
+                        total_load = total_load + report_df[f'{tech_id} Load (kW)'].to_numpy()
                     else:
-                        results.loc[:, 'Total Load (kW)'] += \
-                            results[f'{der.unique_tech_id()} Original Load (kW)']
+                        total_load = total_load + \
+                            report_df[f'{tech_id} Original Load (kW)'].to_numpy()
                 if der.technology_type == 'Electric Vehicle':
-                    results.loc[:, 'Total Load (kW)'] += \
-                        results[f'{der.unique_tech_id()} Charge (kW)']
+                    total_load = total_load + report_df[f'{tech_id} Charge (kW)'].to_numpy()
                     if der.tag == 'ElectricVehicle1':
-                        results.loc[:, 'Aggregated State of Energy (kWh)'] += \
-                            results[f'{der.unique_tech_id()} State of Energy (kWh)']
-            report = der.monthly_report()
-            monthly_data = pd.concat([monthly_data, report], axis=1, sort=False)
+                        aggregated_soe = aggregated_soe + \
+                            report_df[f'{tech_id} State of Energy (kWh)'].to_numpy()
+            monthly_report = der.monthly_report()
+            if monthly_report is not None:
+                monthly_frames.append(monthly_report)
+
+        results = pd.DataFrame(index=index)
+        results['Total Original Load (kW)'] = total_original_load
+        results['Total Load (kW)'] = total_load
+        results['Total Generation (kW)'] = total_generation
+        results['Total Storage Power (kW)'] = total_storage_power
+        results['Aggregated State of Energy (kWh)'] = aggregated_soe
+        # the most recently added DER's columns come first, followed by the totals
+        results = pd.concat(report_frames[::-1] + [results], axis=1, copy=False)
+        monthly_data = pd.DataFrame()
+        if len(monthly_frames):
+            monthly_data = pd.concat(monthly_frames, axis=1, sort=False, copy=False)
         # assumes the orginal net load only does not contain the Storage system
         # check if Total Original Load and Total Load are the same.
-        if np.all(results['Total Load (kW)'] == results['Total Original Load (kW)']):
+        if np.array_equal(total_load, total_original_load):
             # Drop Total Original Load
             results.drop('Total Original Load (kW)', axis=1, inplace=True)
         # net load is the load see at the POI
-        results.loc[:, 'Net Load (kW)'] = \
-            results.loc[:, 'Total Load (kW)'] - results.loc[:, 'Total Generation (kW)'] - \
-            results.loc[:, 'Total Storage Power (kW)']
+        results['Net Load (kW)'] = total_load - total_generation - total_storage_power
         return results, monthly_data
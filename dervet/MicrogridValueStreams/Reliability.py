@@ -248,6 +248,8 @@ class Reliability(ValueStream):
             for der_instance in der_list:
                 # initialize variables
                 der_instance.initialize_variables(outage_length)
+                # (a CHP's electric/heat coupling is not part of its constraints, see
+                # CHP.collect_constraints)
                 consts += der_instance.constraints(mask, sizing_for_rel=True,
                                                    find_min_soe=False)
                 if der_instance.technology_type == 'Energy Storage System':
@@ -633,6 +635,8 @@ class Reliability(ValueStream):
                     if der.technology_type == 'Intermittent Resource':
                         var_gen_sum += der.get_discharge(outage_mask)
 
+                    # (a CHP's electric/heat coupling is not part of its constraints, see
+                    # CHP.collect_constraints)
                     consts += der.constraints(outage_mask,
                                               sizing_for_rel=True,
                                               find_min_soe=True)
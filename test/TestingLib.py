@@ -27,12 +27,14 @@ Copyright (c) 2021, Electric Power Research Institute
  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
-from dervet.DERVET import DERVET
 import os
+import numpy as np
 import pandas as pd
 
 
 def run_case(model_param_location: str):
+    # imported here so that collecting the tests does not load dervet (and cvxpy)
+    from dervet.DERVET import DERVET
     print(f"Testing {model_param_location}...")
     case = DERVET(model_param_location)
     results = case.solve()
@@ -41,6 +43,7 @@ def run_case(model_param_location: str):
 
 
 def check_initialization(model_param_location: str):
+    from dervet.DERVET import DERVET
     print(f"Testing {model_param_location}...")
     case = DERVET(model_param_location)
     return case
@@ -63,6 +66,18 @@ def assert_within_error_bound(actual: float, test_value: float, error_bound: flo
     assert diff/actual <= error_bound/100, error_message + f'Test value: {test_value}   Should be in range: ({actual+(actual*(error_bound/100))},{actual-(actual*(error_bound/100))}) \n'
 
 
+def find_outside_error_bound(actual: np.ndarray, test_values: np.ndarray, error_bound: float):
+    """ Element-wise version of assert_within_error_bound. Returns the positions (as rows of
+    np.argwhere) at which TEST_VALUES is not within ERROR_BOUND percent of ACTUAL.
+    """
+    actual = np.asarray(actual, dtype=float)
+    test_values = np.asarray(test_values, dtype=float)
+    diff = np.abs(actual - test_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        within_bound = (diff == 0) | (diff / actual <= error_bound / 100)
+    return np.argwhere(~within_bound)
+
+
 ##########################################
 
 
@@ -85,7 +100,10 @@ def compare_proforma_results(results, frozen_proforma_location: str, error_bound
     assert_file_exists(results, 'pro_forma')
     test_proforma_df = results.proforma_df()
     expected_df = pd.read_csv(frozen_proforma_location, index_col='Unnamed: 0')
-    for yr_indx, values_series in expected_df.iterrows():
+    # match each row of the expected proforma to its row in the test proforma
+    expected_rows = []
+    actual_rows = []
+    for row_pos, yr_indx in enumerate(expected_df.index):
         try:
             actual_indx = pd.Period(yr_indx)
             if opt_years is not None and actual_indx.year not in opt_years:
@@ -94,10 +112,18 @@ def compare_proforma_results(results, frozen_proforma_location: str, error_bound
             actual_indx = yr_indx
         # print(actual_indx)
         assert actual_indx in test_proforma_df.index, f'{actual_indx} not in test proforma index'
-        for col_indx in values_series.index:
-            assert col_indx in test_proforma_df.columns, f'{col_indx} not in test proforma columns'
-            error_message = f'ValueError in Proforma [{yr_indx}, {col_indx}]\n'
-            assert_within_error_bound(expected_df.loc[yr_indx, col_indx], test_proforma_df.loc[actual_indx, col_indx], error_bound, error_message)
+        expected_rows.append(row_pos)
+        actual_rows.append(actual_indx)
+    for col_indx in expected_df.columns:
+        assert col_indx in test_proforma_df.columns, f'{col_indx} not in test proforma columns'
+    # compare all the matched rows at once
+    expected_values = expected_df.iloc[expected_rows].to_numpy()
+    test_values = test_proforma_df.loc[actual_rows, expected_df.columns].to_numpy()
+    outside = find_outside_error_bound(expected_values, test_values, error_bound)
+    if len(outside):
+        row_pos, col_pos = outside[0]
+        error_message = f'ValueError in Proforma [{expected_df.index[expected_rows[row_pos]]}, {expected_df.columns[col_pos]}]\n'
+        assert_within_error_bound(expected_values[row_pos, col_pos], test_values[row_pos, col_pos], error_bound, error_message)
 
 
 def check_lcpc(results, test_model_param_location: str):
@@ -128,7 +154,7 @@ def compare_size_results(results, frozen_size_location: str, error_bound: float)
         for col in actual_df.columns:
             test_value = test_df.loc[der_name, col]
             actual_value = actual_df.loc[der_name, col]
-            if str(test_value) != 'nan' and str(actual_value) != 'nan':
+            if not pd.isna(test_value) and not pd.isna(actual_value):
                 error_message = f'ValueError in [{der_name}, {col}]\nExpected: {actual_value}\nGot: {test_value}'
 
                 assert_within_error_bound(actual_value, test_value, error_bound, error_message)
@@ -138,11 +164,17 @@ def compare_lcpc_results(results, frozen_lcpc_location: str, error_bound: float)
     test_df = results.instances[0].drill_down_dict.get('load_coverage_prob')
     assert test_df is not None
     actual_df = pd.read_csv(frozen_lcpc_location)
-    for time_step in actual_df.index:
-
-        test_value = test_df.loc[time_step]['Load Coverage Probability (%)']
-        actual_value = actual_df.loc[time_step]['Load Coverage Probability (%)']
-        if test_value is not 'nan' and actual_value is not 'nan':
-            error_message = f'ValueError in [{time_step}]\nExpected: {actual_value}\nGot: {test_value}'
-
-            assert_within_error_bound(actual_value, test_value, error_bound, error_message)
+    actual_values = actual_df['Load Coverage Probability (%)'].to_numpy()
+    # look up the test values by the expected time steps (test_df is indexed by outage length)
+    test_values = test_df.loc[actual_df.index, 'Load Coverage Probability (%)'].to_numpy()
+    # only compare the time steps at which both values are numbers
+    compared = ~(np.isnan(actual_values) | np.isnan(test_values))
+    outside = find_outside_error_bound(actual_values[compared], test_values[compared], error_bound)
+    if len(outside):
+        position = np.flatnonzero(compared)[outside[0][0]]
+        time_step = actual_df.index[position]
+        test_value = test_values[position]
+        actual_value = actual_values[position]
+        error_message = f'ValueError in [{time_step}]\nExpected: {actual_value}\nGot: {test_value}'
+
+        assert_within_error_bound(actual_value, test_value, error_bound, error_message)
@@ -58,3 +58,33 @@ def test_battery_timeseries_constraints():
     assert np.all(timeseries['BATTERY: battery Discharge (kW)'] <= discharge_constraint)
     assert np.all(timeseries['BATTERY: battery Charge (kW)'] <= charge_constraint)
 
+
+def test_chp_thermal_load_opt_year_not_first_data_year():
+    # the time series has data for 2017 and 2018, but only 2018 is optimized
+    test_file = DIR / f'003-CHP_thermal_load_opt_year_2018{CSV}'
+    results = assert_ran(test_file)
+    case_results = results.instances[0]
+    timeseries = case_results.time_series_data
+    assert np.all(timeseries.index.year == 2018)
+    site_steam_load = timeseries['CHP: chp gen 1 Site Steam Thermal Load (BTU/hr)']
+    site_hotwater_load = timeseries['CHP: chp gen 1 Site Hot Water Thermal Load (BTU/hr)']
+    assert not site_steam_load.isna().any()
+    assert not site_hotwater_load.isna().any()
+    # there are two CHPs (with different ratios), so their coupling constraints are stacked
+    chps = [der for der in case_results.poi.der_list if der.tag == 'CHP']
+    assert len(chps) == 2
+    total_steam = 0
+    total_hotwater = 0
+    for chp in chps:
+        steam = timeseries[f'{chp.unique_tech_id()} Steam Generation (kW)']
+        hotwater = timeseries[f'{chp.unique_tech_id()} Hot Water Generation (kW)']
+        # steam and hotwater are reported from the rows of the CHP's single thermal variable
+        assert np.allclose(steam, chp.variables_df['steam'])
+        assert np.allclose(hotwater, chp.variables_df['hotwater'])
+        # each CHP is held to its own ratios
+        assert np.all(steam <= chp.max_steam_ratio * hotwater + 1e-6)
+        assert np.allclose(chp.variables_df['elec'], chp.electric_heat_ratio * (steam + hotwater))
+        total_steam += steam
+        total_hotwater += hotwater
+    assert np.all(total_steam >= site_steam_load - 1e-6)
+    assert np.all(total_hotwater >= site_hotwater_load - 1e-6)